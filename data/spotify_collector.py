@@ -1,17 +1,39 @@
+import asyncio
 import os
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import shelve
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
 import spotipy
+from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyOAuth
 import pandas as pd
 import numpy as np
 from dotenv import load_dotenv
 import logging
 from tqdm import tqdm
+import threading
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+API_BASE = 'https://api.spotify.com/v1'
+
 class SpotifyDataCollector:
     def __init__(self):
         load_dotenv()
@@ -20,9 +42,31 @@ class SpotifyDataCollector:
         self.redirect_uri = os.getenv('SPOTIFY_REDIRECT_URI')
         if not self.client_id or not self.client_secret:
             raise ValueError("Spotify API credentials not found in environment variables")
+        # Cap concurrent HTTP calls across all worker threads to stay under
+        # Spotify's per-app concurrency ceiling.
+        self._http_semaphore = threading.Semaphore(8)
+        # Persistent cache for track info (Spotify IDs are immutable) and
+        # playlist contents (keyed on snapshot_id, so edits invalidate).
+        self.cache = shelve.open('.spotify_track_cache')
+        self._cache_lock = threading.Lock()
+        # Per-process memo for search results; the per-mood query variants
+        # and overlapping moods repeat the same searches within a run
+        self._search_cache = {}
+        self._search_lock = threading.Lock()
         logger.info("Initializing Spotify client...")
+        # Larger keep-alive pool so worker threads reuse TLS connections
+        # instead of re-handshaking under bursty call patterns
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(total=5, backoff_factor=0.5,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         try:
-            self.sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
+            self.sp = spotipy.Spotify(requests_session=session, auth_manager=SpotifyOAuth(
                 client_id=self.client_id,
                 client_secret=self.client_secret,
                 redirect_uri=self.redirect_uri,
@@ -46,62 +90,101 @@ class SpotifyDataCollector:
                 logger.error(f"Response headers: {json.dumps(dict(e.response.headers), indent=2)}")
             raise
 
+    def _is_retryable(self, e):
+        if isinstance(e, SpotifyException):
+            return e.http_status in (429, 403) or (e.http_status is not None and e.http_status >= 500)
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        return '429' in str(e) or '403' in str(e)
+
+    def _retry_after_seconds(self, e):
+        headers = getattr(e, 'headers', None) or {}
+        retry_after = headers.get('Retry-After')
+        if retry_after is None:
+            return None
+        try:
+            return int(retry_after)
+        except (TypeError, ValueError):
+            return None
+
     def _handle_rate_limit(self, func, *args, **kwargs):
-        max_retries = 3
-        base_delay = 2
+        max_retries = 5
+        base_delay = 1
+        max_delay = 60
+        delay = base_delay
         for attempt in range(max_retries):
             try:
-                time.sleep(1)
-                return func(*args, **kwargs)
+                with self._http_semaphore:
+                    return func(*args, **kwargs)
             except Exception as e:
-                if '429' in str(e) or '403' in str(e):
-                    if attempt < max_retries - 1:
-                        delay = base_delay * (2 ** attempt)
-                        logger.warning(f"Rate limit hit, waiting {delay} seconds...")
-                        if hasattr(e, 'response'):
-                            logger.error(f"Response status: {e.response.status_code}")
-                            logger.error(f"Response headers: {json.dumps(dict(e.response.headers), indent=2)}")
-                            if hasattr(e.response, 'text'):
-                                logger.error(f"Response body: {e.response.text}")
-                        time.sleep(delay)
-                        continue
-                raise
+                if not self._is_retryable(e) or attempt >= max_retries - 1:
+                    raise
+                retry_after = self._retry_after_seconds(e)
+                if retry_after is not None:
+                    delay = retry_after
+                else:
+                    # Decorrelated jitter: sleep somewhere between the base
+                    # delay and three times the previous delay, capped.
+                    delay = min(max_delay, random.uniform(base_delay, delay * 3))
+                logger.warning(f"Retryable Spotify error, waiting {delay:.1f} seconds...")
+                if hasattr(e, 'response'):
+                    logger.error(f"Response status: {e.response.status_code}")
+                    logger.error(f"Response headers: {json.dumps(dict(e.response.headers), indent=2)}")
+                    if hasattr(e.response, 'text'):
+                        logger.error(f"Response body: {e.response.text}")
+                time.sleep(delay)
 
-    def get_track_info(self, track_id):
-        try:
-            logger.info(f"Fetching track info for {track_id}")
-            track = self._handle_rate_limit(self.sp.track, track_id)
-            if not track:
-                logger.warning(f"No track info found for {track_id}")
-                return None
-            return {
-                'id': track['id'],
-                'name': track['name'],
-                'artist': track['artists'][0]['name'],
-                'popularity': track['popularity'],
-                'duration_ms': track['duration_ms'],
-                'album': track['album']['name'],
-                'release_date': track['album']['release_date'],
-                'explicit': track['explicit'],
-                'track_number': track['track_number'],
-                'disc_number': track['disc_number'],
-                'available_markets': len(track['available_markets']),
-                'is_local': track['is_local'],
-                'album_type': track['album']['album_type'],
-                'album_release_date': track['album']['release_date'],
-                'album_total_tracks': track['album']['total_tracks'],
-                'artist_popularity': track['artists'][0].get('popularity', 0),
-                'artist_genres': track['artists'][0].get('genres', []),
-                'artist_followers': track['artists'][0].get('followers', {}).get('total', 0)
-            }
-        except Exception as e:
-            logger.error(f"Error fetching track info for {track_id}: {str(e)}")
-            if hasattr(e, 'response'):
-                logger.error(f"Response status: {e.response.status_code}")
-                logger.error(f"Response headers: {json.dumps(dict(e.response.headers), indent=2)}")
-                if hasattr(e.response, 'text'):
-                    logger.error(f"Response body: {e.response.text}")
-            return None
+    def _cache_get(self, key):
+        with self._cache_lock:
+            return self.cache.get(key)
+
+    def _cache_set(self, key, value):
+        with self._cache_lock:
+            self.cache[key] = value
+
+    def _chunked(self, items, size=50):
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+    def _parse_track(self, track, artist_lookup):
+        artist = artist_lookup.get(track['artists'][0].get('id'), {})
+        return {
+            'id': track['id'],
+            'name': track['name'],
+            'artist': track['artists'][0]['name'],
+            'popularity': track['popularity'],
+            'duration_ms': track['duration_ms'],
+            'album': track['album']['name'],
+            'release_date': track['album']['release_date'],
+            'explicit': track['explicit'],
+            'track_number': track['track_number'],
+            'disc_number': track['disc_number'],
+            'available_markets': len(track['available_markets']),
+            'is_local': track['is_local'],
+            'album_type': track['album']['album_type'],
+            'album_release_date': track['album']['release_date'],
+            'album_total_tracks': track['album']['total_tracks'],
+            'artist_popularity': artist.get('popularity', 0),
+            'artist_genres': artist.get('genres', []),
+            'artist_followers': artist.get('followers', {}).get('total', 0)
+        }
+
+    def _fetch_artists_batch(self, artist_ids):
+        artist_lookup = {}
+        for chunk in self._chunked(artist_ids):
+            try:
+                logger.info(f"Fetching artist info for {len(chunk)} artists")
+                results = self._handle_rate_limit(self.sp.artists, chunk)
+                if results and 'artists' in results:
+                    for artist in results['artists']:
+                        if artist:
+                            artist_lookup[artist['id']] = artist
+            except Exception as e:
+                logger.error(f"Error fetching artist batch: {str(e)}")
+                if hasattr(e, 'response'):
+                    logger.error(f"Response status: {e.response.status_code}")
+                    logger.error(f"Response headers: {json.dumps(dict(e.response.headers), indent=2)}")
+        return artist_lookup
 
     def search_playlists_by_mood(self, mood, limit=5):
         all_playlists = []
@@ -112,19 +195,18 @@ class SpotifyDataCollector:
             f"{mood} songs",
             f"{mood} playlist"
         ]
-        for query in queries:
+        def run_query(query):
+            cache_key = (query, 'playlist', limit)
+            with self._search_lock:
+                if cache_key in self._search_cache:
+                    logger.info(f"Using cached search results for query: {query}")
+                    return self._search_cache[cache_key]
             try:
                 logger.info(f"Searching with query: {query}")
                 results = self._handle_rate_limit(self.sp.search, q=query, type='playlist', limit=limit)
-                if not results or 'playlists' not in results or 'items' not in results['playlists']:
-                    logger.warning(f"No results for query: {query}")
-                    continue
-                playlists = results['playlists']['items']
-                logger.info(f"Found {len(playlists)} playlists for query: {query}")
-                for playlist in playlists:
-                    if playlist['id'] not in seen_ids:
-                        seen_ids.add(playlist['id'])
-                        all_playlists.append(playlist)
+                with self._search_lock:
+                    self._search_cache[cache_key] = results
+                return results
             except Exception as e:
                 logger.error(f"Error processing query '{query}': {str(e)}")
                 if hasattr(e, 'response'):
@@ -132,11 +214,29 @@ class SpotifyDataCollector:
                     logger.error(f"Response headers: {json.dumps(dict(e.response.headers), indent=2)}")
                     if hasattr(e.response, 'text'):
                         logger.error(f"Response body: {e.response.text}")
+                return None
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            query_results = list(executor.map(run_query, queries))
+        for query, results in zip(queries, query_results):
+            if not results or 'playlists' not in results or 'items' not in results['playlists']:
+                logger.warning(f"No results for query: {query}")
                 continue
+            playlists = results['playlists']['items']
+            logger.info(f"Found {len(playlists)} playlists for query: {query}")
+            for playlist in playlists:
+                if playlist['id'] not in seen_ids:
+                    seen_ids.add(playlist['id'])
+                    all_playlists.append(playlist)
         logger.info(f"Found {len(all_playlists)} unique playlists for mood: {mood}")
         return all_playlists[:limit]
 
-    def get_playlist_tracks(self, playlist_id):
+    def get_playlist_tracks(self, playlist_id, snapshot_id=None):
+        cache_key = f"playlist:{playlist_id}:{snapshot_id}" if snapshot_id else None
+        if cache_key:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                logger.info(f"Using cached tracks for playlist {playlist_id}")
+                return cached
         try:
             logger.info(f"Fetching tracks from playlist {playlist_id}")
             results = self._handle_rate_limit(self.sp.playlist_tracks, playlist_id)
@@ -145,11 +245,13 @@ class SpotifyDataCollector:
                 return []
             tracks = results['items']
             while results['next'] and len(tracks) < 50:
-                time.sleep(1)
                 results = self._handle_rate_limit(self.sp.next, results)
                 if 'items' in results:
                     tracks.extend(results['items'])
-            return tracks[:50]
+            tracks = tracks[:50]
+            if cache_key:
+                self._cache_set(cache_key, tracks)
+            return tracks
         except Exception as e:
             logger.error(f"Error fetching tracks from playlist {playlist_id}: {str(e)}")
             if hasattr(e, 'response'):
@@ -160,39 +262,189 @@ class SpotifyDataCollector:
             return []
 
     def collect_mood_data(self, mood, num_tracks=20):
-        tracks_data = []
         playlists = self.search_playlists_by_mood(mood)
+        # playlist_tracks already returns full track objects, so no track
+        # lookup is needed at all — only artist details require a fetch
+        tracks = []
+        seen_ids = set()
         for playlist in tqdm(playlists, desc=f"Processing playlists for mood: {mood}"):
-            playlist_tracks = self.get_playlist_tracks(playlist['id'])
+            if len(tracks) >= num_tracks:
+                break
+            playlist_tracks = self.get_playlist_tracks(playlist['id'], playlist.get('snapshot_id'))
             for track_item in playlist_tracks:
-                if len(tracks_data) >= num_tracks:
+                if len(tracks) >= num_tracks:
                     break
                 track = track_item['track']
-                if not track or not track['id']:
+                if not track or not track['id'] or track['id'] in seen_ids:
                     continue
-                track_info = self.get_track_info(track['id'])
-                if not track_info:
-                    continue
-                track_data = {
+                seen_ids.add(track['id'])
+                tracks.append(track)
+        track_info_by_id = {}
+        uncached_tracks = []
+        for track in tracks:
+            cached = self._cache_get(f"track:{track['id']}")
+            if cached is not None:
+                track_info_by_id[track['id']] = cached
+            else:
+                uncached_tracks.append(track)
+        if uncached_tracks:
+            logger.info(f"{len(tracks) - len(uncached_tracks)} of {len(tracks)} tracks served from cache")
+        artist_ids = []
+        seen_artists = set()
+        for track in uncached_tracks:
+            artist_id = track['artists'][0].get('id')
+            if artist_id and artist_id not in seen_artists:
+                seen_artists.add(artist_id)
+                artist_ids.append(artist_id)
+        artist_lookup = self._fetch_artists_batch(artist_ids)
+        for track in uncached_tracks:
+            track_info = self._parse_track(track, artist_lookup)
+            self._cache_set(f"track:{track['id']}", track_info)
+            track_info_by_id[track['id']] = track_info
+        tracks_data = []
+        for track in tracks:
+            if track['id'] in track_info_by_id:
+                tracks_data.append({
                     'mood': mood,
-                    **track_info
-                }
-                tracks_data.append(track_data)
-                time.sleep(1.5)
+                    **track_info_by_id[track['id']]
+                })
         return tracks_data
 
     def collect_all_mood_data(self, moods=None):
         if moods is None:
             moods = ['happy', 'sad', 'energetic', 'calm', 'angry', 'romantic', 'melancholic']
         all_data = []
-        for mood in tqdm(moods, desc="Processing moods"):
-            mood_data = self.collect_mood_data(mood)
+        with ThreadPoolExecutor(max_workers=len(moods)) as executor:
+            mood_results = list(tqdm(executor.map(self.collect_mood_data, moods),
+                                     total=len(moods), desc="Processing moods"))
+        for mood_data in mood_results:
+            all_data.extend(mood_data)
+        return pd.DataFrame(all_data)
+
+    async def _async_get(self, session, semaphore, url, params=None):
+        max_retries = 5
+        for attempt in range(max_retries):
+            async with semaphore:
+                async with session.get(url, params=params) as response:
+                    if response.status == 429 or response.status >= 500:
+                        retry_after = int(response.headers.get('Retry-After', 1))
+                        logger.warning(f"Retryable status {response.status}, waiting {retry_after} seconds...")
+                        await asyncio.sleep(retry_after)
+                        continue
+                    response.raise_for_status()
+                    return await response.json()
+        raise Exception(f"Giving up on {url} after {max_retries} attempts")
+
+    async def collect_mood_data_async(self, session, semaphore, mood, num_tracks=20):
+        queries = [
+            f"mood {mood}",
+            f"{mood} music",
+            f"{mood} songs",
+            f"{mood} playlist"
+        ]
+        search_results = await asyncio.gather(*[
+            self._async_get(session, semaphore, f"{API_BASE}/search",
+                            params={'q': query, 'type': 'playlist', 'limit': 5})
+            for query in queries
+        ], return_exceptions=True)
+        playlists = []
+        seen_playlists = set()
+        for results in search_results:
+            if isinstance(results, Exception):
+                logger.error(f"Error searching playlists for mood {mood}: {str(results)}")
+                continue
+            for playlist in results.get('playlists', {}).get('items', []):
+                if playlist['id'] not in seen_playlists:
+                    seen_playlists.add(playlist['id'])
+                    playlists.append(playlist)
+        playlists = playlists[:5]
+        track_pages = await asyncio.gather(*[
+            self._async_get(session, semaphore, f"{API_BASE}/playlists/{playlist['id']}/tracks",
+                            params={'limit': 50})
+            for playlist in playlists
+        ], return_exceptions=True)
+        tracks = []
+        seen_ids = set()
+        for page in track_pages:
+            if isinstance(page, Exception):
+                logger.error(f"Error fetching playlist tracks for mood {mood}: {str(page)}")
+                continue
+            for track_item in page.get('items', []):
+                if len(tracks) >= num_tracks:
+                    break
+                track = track_item['track']
+                if not track or not track['id'] or track['id'] in seen_ids:
+                    continue
+                seen_ids.add(track['id'])
+                tracks.append(track)
+        track_info_by_id = {}
+        uncached_tracks = []
+        for track in tracks:
+            cached = self._cache_get(f"track:{track['id']}")
+            if cached is not None:
+                track_info_by_id[track['id']] = cached
+            else:
+                uncached_tracks.append(track)
+        artist_ids = []
+        seen_artists = set()
+        for track in uncached_tracks:
+            artist_id = track['artists'][0].get('id')
+            if artist_id and artist_id not in seen_artists:
+                seen_artists.add(artist_id)
+                artist_ids.append(artist_id)
+        artist_pages = await asyncio.gather(*[
+            self._async_get(session, semaphore, f"{API_BASE}/artists",
+                            params={'ids': ','.join(chunk)})
+            for chunk in self._chunked(artist_ids)
+        ], return_exceptions=True)
+        artist_lookup = {}
+        for page in artist_pages:
+            if isinstance(page, Exception):
+                logger.error(f"Error fetching artists for mood {mood}: {str(page)}")
+                continue
+            for artist in page.get('artists', []):
+                if artist:
+                    artist_lookup[artist['id']] = artist
+        for track in uncached_tracks:
+            track_info = self._parse_track(track, artist_lookup)
+            self._cache_set(f"track:{track['id']}", track_info)
+            track_info_by_id[track['id']] = track_info
+        return [{'mood': mood, **track_info_by_id[t['id']]}
+                for t in tracks if t['id'] in track_info_by_id]
+
+    async def collect_all_mood_data_async(self, moods=None):
+        """Async variant of collect_all_mood_data.
+
+        Issues all searches, playlist-track fetches, and artist batches as
+        in-flight aiohttp requests bounded by a semaphore, reusing the sync
+        token and on-disk cache. Run with
+        asyncio.run(collector.collect_all_mood_data_async(moods)).
+        """
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for async collection")
+        if moods is None:
+            moods = ['happy', 'sad', 'energetic', 'calm', 'angry', 'romantic', 'melancholic']
+        token = self.sp._auth_manager.get_access_token(as_dict=False)
+        semaphore = asyncio.Semaphore(8)
+        connector = aiohttp.TCPConnector(limit=20)
+        headers = {'Authorization': f"Bearer {token}"}
+        async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+            mood_results = await asyncio.gather(*[
+                self.collect_mood_data_async(session, semaphore, mood)
+                for mood in moods
+            ])
+        all_data = []
+        for mood_data in mood_results:
             all_data.extend(mood_data)
         return pd.DataFrame(all_data)
 
     def save_data(self, data, filename='spotify_mood_data.csv'):
         data.to_csv(filename, index=False)
-        logger.info(f"Data saved to {filename}")
+        # Also write a Parquet sibling: columnar, typed, compressed, and far
+        # faster to read back than CSV
+        parquet_path = os.path.splitext(filename)[0] + '.parquet'
+        data.to_parquet(parquet_path, index=False)
+        logger.info(f"Data saved to {filename} and {parquet_path}")
 
     def create_playlist(self, name, description, tracks_df):
         try:
@@ -205,10 +457,17 @@ class SpotifyDataCollector:
                 public=True
             )
             track_uris = [f"spotify:track:{track_id}" for track_id in tracks_df['id']]
-            for i in range(0, len(track_uris), 100):
-                chunk = track_uris[i:i + 100]
-                self.sp.playlist_add_items(playlist['id'], chunk)
-                time.sleep(1)
+            chunks = [(i, track_uris[i:i + 100]) for i in range(0, len(track_uris), 100)]
+
+            def add_chunk(args):
+                # Explicit position keeps insertion order stable even though
+                # chunks complete out of order
+                position, chunk = args
+                return self._handle_rate_limit(self.sp.playlist_add_items,
+                                               playlist['id'], chunk, position=position)
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(add_chunk, chunks))
             logger.info(f"Created playlist: {playlist['name']}")
             logger.info(f"Playlist URL: {playlist['external_urls']['spotify']}")
             return playlist
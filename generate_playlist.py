@@ -1,5 +1,7 @@
 import argparse
+import hashlib
 import logging
+import joblib
 from data.spotify_collector import SpotifyDataCollector
 from models.transition_model import TransitionModel
 import pandas as pd
@@ -20,17 +22,41 @@ def main():
     collector = SpotifyDataCollector()
     moods = ['happy', 'sad', 'energetic', 'calm', 'angry', 'romantic', 'melancholic']
 
+    dataset_csv = 'data/emotional_music_dataset.csv'
+    dataset_parquet = 'data/emotional_music_dataset.parquet'
+
     if args.update_data:
         logger.info("Collecting music data...")
         dataset = collector.collect_all_mood_data(moods)
-        collector.save_data(dataset, 'data/emotional_music_dataset.csv')
+        collector.save_data(dataset, dataset_csv)
+    elif os.path.exists(dataset_parquet):
+        dataset = pd.read_parquet(dataset_parquet)
+    elif os.path.exists(dataset_csv):
+        dataset = pd.read_csv(dataset_csv, engine='pyarrow')
     else:
-        if not os.path.exists('data/emotional_music_dataset.csv'):
-            raise FileNotFoundError("Dataset not found. Please run with --update_data first.")
-        dataset = pd.read_csv('data/emotional_music_dataset.csv')
+        raise FileNotFoundError("Dataset not found. Please run with --update_data first.")
 
-    model = TransitionModel()
-    model.train(dataset)
+    # Fitting the scaler, KMeans, and graph is deterministic for a given
+    # dataset, so cache the trained model keyed by the dataset content hash
+    # and skip retraining when nothing changed
+    # Stringify object columns first: artist_genres holds lists (or ndarrays
+    # after a parquet round-trip), which hash_pandas_object cannot hash
+    dataset_hash = hashlib.md5(
+        pd.util.hash_pandas_object(
+            dataset.astype({col: str for col in dataset.select_dtypes(include='object').columns}),
+            index=False
+        ).values.tobytes()
+    ).hexdigest()
+    model_cache = os.path.join('.cache', f"model_{dataset_hash}.joblib")
+    if os.path.exists(model_cache):
+        logger.info(f"Loading cached model from {model_cache}")
+        model = joblib.load(model_cache)
+    else:
+        model = TransitionModel()
+        model.train(dataset)
+        os.makedirs('.cache', exist_ok=True)
+        joblib.dump(model, model_cache)
+        logger.info(f"Cached trained model to {model_cache}")
 
     playlist = model.generate_playlist(
         start_emotion=args.start_emotion,